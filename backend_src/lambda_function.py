@@ -1,11 +1,12 @@
 import base64
 import boto3
 import botocore
+import concurrent.futures
 import decimal
+import functools
 import html as htmlmod
 import io
 import json
-import json as _json
 import mimetypes
 import os
 import re
@@ -13,14 +14,35 @@ import socket
 import ssl
 import time
 import urllib.error
+import urllib.parse
 import urllib.request
+import urllib3
 import uuid
 
 from boto3.dynamodb.conditions import Key, Attr
-from pypdf import PdfReader
+from botocore.auth import S3SigV4QueryAuth
+from botocore.awsrequest import AWSRequest
+from botocore.config import Config
+
+# PyMuPDF (MuPDF C engine) is much faster than pypdf; keep pypdf as fallback
+# for deployments whose layer only ships the pure-Python reader.
+try:
+    import fitz
+except ImportError:
+    fitz = None
+    from pypdf import PdfReader
+
+# orjson (Rust) serializes/parses several times faster than stdlib json;
+# same optional-import treatment as fitz.
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # ------------------ Config ------------------
 MAX_DOCS_PER_USER = 10  # keep in sync with UI
+COUNTER_DOC_ID = "__count__"  # per-user doc counter item in DOCS_TABLE
+COUNTER_STALE_SECS = 900  # max Lambda timeout; an older counter has no in-flight slots
 ALLOWED_EXTS = ("pdf", "doc", "docx", "txt")
 REGION = os.environ.get("AWS_REGION", "us-east-2")
 
@@ -28,26 +50,85 @@ REGION = os.environ.get("AWS_REGION", "us-east-2")
 # Tunables for OpenAI HTTP call (env overrideable)
 OPENAI_HTTP_TIMEOUT = float(os.environ.get("OPENAI_HTTP_TIMEOUT", "18.0"))  # seconds per call
 OPENAI_MAX_RETRIES  = int(os.environ.get("OPENAI_MAX_RETRIES", "1"))       # 0 or 1 is sensible here
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "")  # empty => AI disabled
+OPENAI_STREAM_CHECK_CHARS = 2048  # body chars streamed before the early name check
+_DIAG_AUTH_HEADER = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
+
+# PDF extraction limits: stop after this many pages, and once we already have
+# some text, skip pages whose content stream is mostly graphics operators.
+PDF_MAX_PAGES = 40
+PDF_HEAVY_STREAM_BYTES = 512 * 1024
+PDF_SKIP_HEAVY_AFTER_CHARS = 5000
 
 # Hard cap all network ops (urllib + sockets)
 socket.setdefaulttimeout(12)
 
+# Shared pool for api.openai.com so TCP+TLS handshakes amortize across warm invokes
+_HTTP = urllib3.PoolManager(
+    num_pools=2, maxsize=4,
+    retries=urllib3.Retry(total=OPENAI_MAX_RETRIES, backoff_factor=0.3),
+    timeout=urllib3.Timeout(connect=4, read=OPENAI_HTTP_TIMEOUT),
+)
+
 
 # ------------------ Utils ------------------
+def _json_default(o):
+    if isinstance(o, decimal.Decimal):
+        return int(o) if o % 1 == 0 else float(o)
+    raise TypeError(f"Object of type {o.__class__.__name__} is not JSON serializable")
+
+def _dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_json_default)
+    return json.dumps(obj, default=_json_default).encode("utf-8")
+
+def _loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, bytes):
+        data = data.decode("utf-8", "ignore")
+    return json.loads(data)
+
 def _resp(code, obj):
-    def _json_default(o):
-        if isinstance(o, decimal.Decimal):
-            return int(o) if o % 1 == 0 else float(o)
-        raise TypeError(f"Object of type {o.__class__.__name__} is not JSON serializable")
     # IMPORTANT: Only Content-Type. No CORS headers here.
     return {
         "statusCode": code,
         "headers": {"Content-Type": "application/json"},
-        "body": json.dumps(obj, default=_json_default),
+        "body": _dumps(obj).decode("utf-8"),
     }
 
 def _extract_pdf_text(data: bytes, max_chars: int = 20000) -> str:
-    """Best-effort text extraction for 'application/pdf' using pypdf."""
+    """Best-effort text extraction for 'application/pdf' (PyMuPDF, else pypdf)."""
+    if fitz is None:
+        return _extract_pdf_text_pypdf(data, max_chars)
+    try:
+        doc = fitz.open(stream=data, filetype="pdf")
+    except Exception as e:
+        return f"[Could not extract PDF text: {e}]"
+    try:
+        if doc.needs_pass and not doc.authenticate(""):  # try empty password
+            return "[PDF is encrypted; text not extracted]"
+        out = []
+        total = 0
+        for i, page in enumerate(doc):
+            if i >= PDF_MAX_PAGES:
+                break
+            if total > PDF_SKIP_HEAVY_AFTER_CHARS and len(page.read_contents()) > PDF_HEAVY_STREAM_BYTES:
+                continue
+            t = page.get_text("text") or ""
+            out.append(t)
+            total += len(t)
+            if total >= max_chars:
+                break
+        text = "\n".join(out).strip()
+        return text[:max_chars] if text else "[PDF had no extractable text]"
+    except Exception as e:
+        return f"[Could not extract PDF text: {e}]"
+    finally:
+        doc.close()
+
+def _extract_pdf_text_pypdf(data: bytes, max_chars: int = 20000) -> str:
+    """Fallback extraction using pypdf (pure Python, slower)."""
     try:
         reader = PdfReader(io.BytesIO(data))
         if getattr(reader, "is_encrypted", False):
@@ -56,9 +137,17 @@ def _extract_pdf_text(data: bytes, max_chars: int = 20000) -> str:
             except Exception:
                 return "[PDF is encrypted; text not extracted]"
         out = []
-        for page in reader.pages:
-            out.append(page.extract_text() or "")
-            if sum(len(x) for x in out) > max_chars * 1.1:
+        total = 0
+        for i in range(min(len(reader.pages), PDF_MAX_PAGES)):
+            page = reader.pages[i]
+            if total > PDF_SKIP_HEAVY_AFTER_CHARS:
+                contents = page.get_contents()
+                if contents is not None and len(contents.get_data()) > PDF_HEAVY_STREAM_BYTES:
+                    continue
+            t = page.extract_text() or ""
+            out.append(t)
+            total += len(t)
+            if total >= max_chars:
                 break
         text = "\n".join(out).strip()
         return text[:max_chars] if text else "[PDF had no extractable text]"
@@ -72,17 +161,39 @@ def _get_env(name):
     return v
 
 BUCKET = _get_env("BUCKET_NAME")
-APPL_TABLE = boto3.resource("dynamodb").Table(_get_env("APPL_TABLE"))
-DOCS_TABLE = boto3.resource("dynamodb").Table(_get_env("DOCS_TABLE"))
-s3 = boto3.client("s3", region_name=REGION)
+APPL_TABLE_NAME = _get_env("APPL_TABLE")
+DOCS_TABLE_NAME = _get_env("DOCS_TABLE")
+
+_BOTO_CFG = Config(
+    max_pool_connections=20,
+    retries={"mode": "adaptive", "max_attempts": 3},
+    tcp_keepalive=True,
+)
+
+# AWS clients are built on first use (not at import) to keep cold start lean.
+@functools.lru_cache(maxsize=1)
+def _dynamodb():
+    return boto3.resource("dynamodb", region_name=REGION, config=_BOTO_CFG)
+
+@functools.lru_cache(maxsize=1)
+def _appl_table():
+    return _dynamodb().Table(APPL_TABLE_NAME)
+
+@functools.lru_cache(maxsize=1)
+def _docs_table():
+    return _dynamodb().Table(DOCS_TABLE_NAME)
+
+@functools.lru_cache(maxsize=1)
+def _s3():
+    return boto3.client("s3", region_name=REGION, config=_BOTO_CFG)
 
 def _get_body(event):
     body = event.get("body")
     if event.get("isBase64Encoded"):
         body = base64.b64decode(body).decode()
     try:
-        return json.loads(body or "{}")
-    except json.JSONDecodeError:
+        return _loads(body or "{}")
+    except json.JSONDecodeError:  # orjson.JSONDecodeError subclasses this
         raise ValueError("Request body must be valid JSON.")
 
 def _basename(key: str) -> str:
@@ -94,6 +205,11 @@ def _ext(filename: str) -> str:
 def _now() -> int:
     return int(time.time())
 
+JD_MAX_BYTES = 1024 * 1024  # read at most 1MB of a job page
+# One pass: script/style blocks (with their content) or any other tag.
+_HTML_STRIP_RE = re.compile(r"(?is)<(script|style)\b[^>]*>.*?</\1\s*>|<[^>]+>")
+_WS_RE = re.compile(r"\s+")
+
 def _get_text_from_url(url: str, timeout=5) -> str:
     """Fetch visible text from a webpage using stdlib only (no external deps)."""
     if not url:
@@ -104,96 +220,164 @@ def _get_text_from_url(url: str, timeout=5) -> str:
             headers={"User-Agent": "ResumeAssistantBot/1.0 (+https://example.com)"}
         )
         with urllib.request.urlopen(req, timeout=timeout) as r:
-            html = r.read().decode("utf-8", "ignore")
-        # strip script/style
-        html = re.sub(r"(?is)<(script|style).*?>.*?</\1>", " ", html)
-        # drop tags
-        text = re.sub(r"(?s)<[^>]+>", " ", html)
-        text = htmlmod.unescape(" ".join(text.split()))
+            html = r.read(JD_MAX_BYTES).decode("utf-8", "ignore")
+        # strip script/style blocks and drop tags
+        text = _HTML_STRIP_RE.sub(" ", html)
+        text = htmlmod.unescape(_WS_RE.sub(" ", text)).strip()
         return text[:20000] if text else "[Fetched page had no visible text]"
     except Exception as e:
         return f"[Could not fetch JD: {e}]"
 
 def _find_doc_by_id(user_id: str, document_id: str):
-    """Try GetItem on (userId, documentId); fall back to Scan if schema differs."""
-    try:
-        res = DOCS_TABLE.get_item(Key={"userId": user_id, "documentId": document_id})
-        item = res.get("Item")
-        if item:
-            return item
-    except botocore.exceptions.ClientError:
-        pass
-    scan = DOCS_TABLE.scan(
-        Limit=1,
-        FilterExpression=(Attr("userId").eq(user_id) & Attr("documentId").eq(document_id))
-    )
-    items = scan.get("Items", [])
-    return items[0] if items else None
+    """GetItem on (userId, documentId). ClientErrors propagate to the caller."""
+    if document_id == COUNTER_DOC_ID:
+        return None
+    res = _docs_table().get_item(Key={"userId": user_id, "documentId": document_id})
+    return res.get("Item")
 
 def _count_docs_for_user(user_id: str) -> int:
+    resp = _docs_table().query(
+        KeyConditionExpression=Key("userId").eq(user_id),
+        FilterExpression=Attr("documentId").ne(COUNTER_DOC_ID),
+        Select="COUNT"
+    )
+    return int(resp.get("Count", 0))
+
+def _is_conditional_check_failed(e: botocore.exceptions.ClientError) -> bool:
+    return e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException"
+
+def _reserve_doc_slot(user_id: str) -> bool:
+    """Atomically bump the per-user doc counter; False if the limit is reached.
+    The counter item is seeded from a real count the first time it is needed.
+    A full counter is recounted only when provably stale: untouched for longer
+    than any Lambda can run, so no reservation can still be in flight."""
+    key = {"userId": user_id, "documentId": COUNTER_DOC_ID}
+    for _ in range(2):
+        try:
+            _docs_table().update_item(
+                Key=key,
+                UpdateExpression="ADD n :one SET updatedAt = :now",
+                ConditionExpression="attribute_exists(n) AND n < :max",
+                ExpressionAttributeValues={":one": 1, ":max": MAX_DOCS_PER_USER, ":now": _now()},
+            )
+            return True
+        except botocore.exceptions.ClientError as e:
+            if not _is_conditional_check_failed(e):
+                raise
+        item = _docs_table().get_item(Key=key).get("Item", {})
+        if "n" not in item:
+            put_kwargs = {"ConditionExpression": "attribute_not_exists(n)"}
+        elif _now() - int(item.get("updatedAt", 0)) > COUNTER_STALE_SECS:
+            # Leaked slots (crash/timeout between reserve and release) heal here.
+            if "updatedAt" in item:
+                put_kwargs = {"ConditionExpression": "n = :old AND updatedAt = :ts",
+                              "ExpressionAttributeValues": {":old": item["n"], ":ts": item["updatedAt"]}}
+            else:
+                put_kwargs = {"ConditionExpression": "n = :old AND attribute_not_exists(updatedAt)",
+                              "ExpressionAttributeValues": {":old": item["n"]}}
+        else:
+            return False
+        try:
+            _docs_table().put_item(
+                Item={**key, "n": _count_docs_for_user(user_id), "updatedAt": _now()},
+                **put_kwargs,
+            )
+        except botocore.exceptions.ClientError as e:
+            if not _is_conditional_check_failed(e):  # lost a race; fine
+                raise
+    return False
+
+def _bump_doc_counter_quietly(user_id: str) -> None:
+    """Count a doc stored without a reservation (the reserve call failed open)."""
     try:
-        resp = DOCS_TABLE.query(
-            KeyConditionExpression=Key("userId").eq(user_id),
-            Select="COUNT"
+        _docs_table().update_item(
+            Key={"userId": user_id, "documentId": COUNTER_DOC_ID},
+            UpdateExpression="ADD n :one SET updatedAt = :now",
+            ConditionExpression="attribute_exists(n)",  # missing => seeded from a count later
+            ExpressionAttributeValues={":one": 1, ":now": _now()},
         )
-        return int(resp.get("Count", 0))
-    except botocore.exceptions.ClientError as e:
-        err = e.response.get("Error", {}).get("Code")
-        msg = e.response.get("Error", {}).get("Message", "")
-        if err == "ValidationException" or "Query condition missed key schema" in msg:
-            total = 0
-            scan_kwargs = {"FilterExpression": Attr("userId").eq(user_id), "Select": "COUNT"}
-            while True:
-                resp = DOCS_TABLE.scan(**scan_kwargs)
-                total += int(resp.get("Count", 0))
-                if "LastEvaluatedKey" not in resp:
-                    break
-                scan_kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
-            return total
-        raise
+    except Exception as e:
+        print("[docs] counter bump skipped", str(e))
+
+def _release_doc_slot(user_id: str) -> None:
+    try:
+        _docs_table().update_item(
+            Key={"userId": user_id, "documentId": COUNTER_DOC_ID},
+            UpdateExpression="ADD n :neg SET updatedAt = :now",
+            ConditionExpression="n > :zero",
+            ExpressionAttributeValues={":neg": -1, ":zero": 0, ":now": _now()},
+        )
+    except Exception as e:
+        print("[docs] counter release skipped", str(e))
 
+CONTACT_SCAN_CHARS = 8000  # contact details live at the top of a resume
 CONTACT_EMAIL_RE = re.compile(r"[A-Z0-9._%+\-]+@[A-Z0-9.\-]+\.[A-Z]{2,}", re.I)
-CONTACT_PHONE_RE = re.compile(r"(?:(?:\+?\d{1,3}[\s\-\.])?(?:\(?\d{3}\)?[\s\-\.])?\d{3}[\s\-\.]\d{4})")
+# Bounded char class (no nested optionals, so linear) with digit guards; used as
+# a fallback so international formats still yield a phone.
+CONTACT_PHONE_RE = re.compile(r"(?<![\d+])\+?\d[\d \-.()]{8,14}\d(?!\d)")
+# Tried first: NANP-style 3-3-4 stops at the number, so trailing years/zips on
+# the same line aren't swallowed.
+_US_PHONE_RE = re.compile(
+    r"(?<![\d+])(?:\+?\d{1,3}[ .-]?)?(?:\(\d{3}\)|\d{3})[ .-]?\d{3}[ .-]?\d{4}(?!\d)"
+)
 LINK_RE = re.compile(r"(?:https?://|www\.)\S+", re.I)
+_SECTION_EXCLUDE_RE = re.compile(r"education|experience|projects|skills", re.I)
+
+def _first_phone(text: str) -> str:
+    m = _US_PHONE_RE.search(text)
+    if m:
+        return m.group(0)
+    for m in CONTACT_PHONE_RE.finditer(text):
+        if 10 <= sum(c.isdigit() for c in m.group(0)) <= 15:  # skip "2019 - 2021"
+            return m.group(0)
+    return ""
 
 def _extract_contact_bits(resume_text: str):
     """Grab first non-empty line as name; also pull email/phone/links if present."""
-    text = (resume_text or "").strip()
+    text = (resume_text or "").strip()[:CONTACT_SCAN_CHARS]
     lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
     name = ""
     if lines:
         for ln in lines[:6]:
-            if not re.search(r"education|experience|projects|skills", ln, re.I):
+            if not _SECTION_EXCLUDE_RE.search(ln):
                 name = ln
                 break
     email = CONTACT_EMAIL_RE.search(text)
-    phone = CONTACT_PHONE_RE.search(text)
-    links = LINK_RE.findall(text)
     seen = set()
     uniq_links = []
-    for u in links:
+    for m in LINK_RE.finditer(text):
+        u = m.group(0)
         if u not in seen:
             uniq_links.append(u); seen.add(u)
+            if len(uniq_links) >= 5:
+                break
     return {"name": name[:120], "email": (email.group(0) if email else ""),
-            "phone": (phone.group(0) if phone else ""), "links": uniq_links[:5]}
-
-def _ensure_invariants_present(html: str, invariants: dict) -> bool:
-    if not html: return False
-    ok = True
-    if invariants.get("name"):
-        ok = ok and (invariants["name"].lower() in html.lower())
-    if invariants.get("email"):
-        ok = ok and (invariants["email"].lower() in html.lower())
-    return ok
+            "phone": _first_phone(text), "links": uniq_links}
+
+def _check_draft(html_l: str, order_needles: list, inv_needles: list) -> tuple:
+    """(order_ok, inv_ok) for a lowercased draft. order_needles must appear
+    left-to-right (each searched after the previous hit); inv_needles anywhere."""
+    pos = 0
+    order_ok = True
+    for needle in order_needles:
+        idx = html_l.find(needle, pos)
+        if idx == -1:
+            order_ok = False
+            break
+        pos = idx + len(needle)  # so "skills" can't match inside "technical skills"
+    inv_ok = all(n in html_l for n in inv_needles)
+    return order_ok, inv_ok
 
 SECTION_CANON = [
     "header","summary","objective","skills","technical skills","experience",
     "work experience","professional experience","projects","education",
     "certifications","awards","publications","activities","volunteering",
 ]
+SECTION_CANON_SET = frozenset(SECTION_CANON)
+_HEADING_STRIP_CHARS = " \t:-•—"
 
 def _normalize_heading(h: str) -> str:
-    h = h.strip(" \t:-•—").strip()
+    h = h.strip(_HEADING_STRIP_CHARS).strip()
     return " ".join(h.split())
 
 def _looks_like_heading(line: str) -> bool:
@@ -204,32 +388,31 @@ def _looks_like_heading(line: str) -> bool:
     words = s.split()
     if len(words) <= 6 and (s.isupper() or s.istitle()):
         return True
-    return s.lower() in SECTION_CANON
+    return s.lower() in SECTION_CANON_SET
+
+SECTION_SCAN_LINES = 400
+SECTION_MAX = 12
 
 def _detect_section_order(resume_text: str) -> list[str]:
     order, seen = [], set()
-    for raw in (resume_text or "").splitlines():
-        if _looks_like_heading(raw):
-            h = _normalize_heading(raw)
-            k = h.lower().rstrip(":")
-            if k not in seen:
-                order.append(h); seen.add(k)
-    dedup, seen2 = [], set()
-    for h in order:
+    for i, raw in enumerate((resume_text or "").splitlines()):
+        if i >= SECTION_SCAN_LINES:
+            break
+        if not _looks_like_heading(raw):
+            continue
+        h = _normalize_heading(raw)
         k = h.lower().rstrip(":")
-        if k not in seen2:
-            dedup.append(h); seen2.add(k)
-    return dedup[:12]
+        if k in seen:
+            continue
+        order.append(h); seen.add(k)
+        if len(order) >= SECTION_MAX:
+            break
+    return order
 
-# ---------- Tailor: produce FULL HTML resume with guardrails ----------
-def _ai_tailor_resume_html(resume_text: str, job_text: str, interests: str) -> str:
-    invariants = _extract_contact_bits(resume_text)
-    section_order = _detect_section_order(resume_text)
-    api_key = os.environ.get("OPENAI_API_KEY")
+_HTML_ESCAPE_TABLE = str.maketrans({"<": "&lt;", ">": "&gt;", "&": "&amp;"})
 
-    if not api_key:
-        safe_resume = (resume_text or "").replace("<", "&lt;").replace(">", "&gt;")
-        return f"""<!doctype html>
+# Static pages, formatted once per call with format_map
+_DISABLED_TMPL = """<!doctype html>
 <html lang="en"><meta charset="utf-8" />
 <title>Tailored Resume (AI disabled)</title>
 <style>
@@ -240,14 +423,88 @@ h1,h2{{margin:0 0 10px}} h1{{font-size:28px}} h2{{font-size:18px;margin-top:22px
 li{{color:#fff}}
 </style>
 <div class="card">
-<h1>{htmlmod.escape(invariants.get("name") or "Your Name")}</h1>
-<div class="muted">{htmlmod.escape(invariants.get("email") or "")} {htmlmod.escape(invariants.get("phone") or "")}</div>
-<p class="muted">{' • '.join(map(htmlmod.escape, invariants.get("links", [])))}</p>
+<h1>{name}</h1>
+<div class="muted">{email} {phone}</div>
+<p class="muted">{links}</p>
 <h2>Original (not parsed)</h2>
 <pre style="white-space:pre-wrap">{safe_resume}</pre>
 </div>
 </html>"""
 
+_ERROR_TMPL = (
+    "<!doctype html><html><head>{css}</head>"
+    "<body><div class='card'>"
+    "<h2>Tailor error</h2>"
+    "<p class='muted'>OpenAI request failed or timed out.</p>"
+    "<pre>{detail}</pre></div></body></html>"
+)
+
+# Prompt pieces and page CSS for the tailor call; only the slots vary per request.
+_CSS = (
+    "<style>\n"
+    "body{font-family:system-ui,-apple-system,Segoe UI,Roboto,Helvetica,Arial,sans-serif;background:#0b1220;color:#e6eaf2;margin:24px}\n"
+    ".card{background:#121a2b;border:1px solid #223154;border-radius:14px;padding:22px;max-width:900px;margin:auto}\n"
+    "h1,h2{margin:0 0 10px} h1{font-size:28px} h2{font-size:18px;margin-top:22px}\n"
+    "ul{margin:8px 0 0 18px}\n"
+    "li{color:#fff}\n"
+    "</style>\n"
+)
+
+_SYSTEM_PROMPT = (
+    "You are a precise, ATS-friendly resume editor.\n"
+    "HARD RULES:\n"
+    "• Do NOT invent or change facts: company names, job titles, locations, date ranges, degrees, school names.\n"
+    "• Keep the original EXPERIENCE role scaffolding (employer/title/location/dates) exactly.\n"
+    "• Rewrite ONLY the bullet points to emphasize JD keywords; keep counts similar (3–6/role) and realistic.\n"
+    "• If a field is missing in the source, omit it rather than fabricating.\n"
+    "• Output a COMPLETE, valid HTML document (<!doctype html>…</html>) with modest inline CSS. No code fences.\n"
+    "• Bullets (<li>) must render with white text (set inline CSS or parent style).\n"
+    "• **Preserve the original SECTION ORDER exactly as provided.**"
+)
+
+_USER_TMPL = (
+    "Produce a tailored resume as HTML.\n\n"
+    "HEADER INVARIANTS (must appear verbatim if present; omit blank lines):\n"
+    "{invariant_block}\n\n"
+    "ORIGINAL SECTION ORDER (must be preserved as-is, including unfamiliar/custom sections):\n"
+    "{order_display}\n\n"
+    "Normalized order keys (for strict compliance):\n"
+    "{order_strict}\n\n"
+    "EXPERIENCE INVARIANTS:\n"
+    "- Read the Experience section in the RESUME TEXT and copy employer names, job titles, locations, and date ranges EXACTLY as written.\n"
+    "- Rewrite only the bullets under each role; incorporate JD keywords naturally without keyword-stuffing.\n\n"
+    "STYLE:\n"
+    "- Sections present in the source must appear in the SAME ORDER. Do not add new sections unless present in the source.\n"
+    "- Concise, metric-oriented bullets where authentic.\n"
+    "- Use <ul><li> for bullets and ensure <li> text is white via CSS.\n\n"
+    "RESUME TEXT (raw/extracted, may be partial):\n"
+    "-----\n{resume}\n-----\n\n"
+    "JOB DESCRIPTION (sanitized):\n"
+    "-----\n{job}\n-----\n\n"
+    "Candidate interests/keywords: {interests}\n"
+)
+
+_RETRY_SUFFIX = (
+    "\n\nIMPORTANT: Your previous draft missed invariants and/or original section order. Regenerate and:\n"
+    "- Include header invariants verbatim if present.\n"
+    "- Keep EXACT section order as listed; do not rename or reorder sections.\n"
+    "- Keep employer/title/location/date scaffolding exactly; only rewrite bullets."
+)
+
+# ---------- Tailor: produce FULL HTML resume with guardrails ----------
+def _ai_tailor_resume_html(resume_text: str, job_text: str, interests: str) -> str:
+    invariants = _extract_contact_bits(resume_text)
+    if not OPENAI_API_KEY:
+        return _DISABLED_TMPL.format_map({
+            "name": htmlmod.escape(invariants.get("name") or "Your Name"),
+            "email": htmlmod.escape(invariants.get("email") or ""),
+            "phone": htmlmod.escape(invariants.get("phone") or ""),
+            "links": " • ".join(map(htmlmod.escape, invariants.get("links", []))),
+            "safe_resume": (resume_text or "").translate(_HTML_ESCAPE_TABLE),
+        })
+
+    section_order = _detect_section_order(resume_text)
+
     # Header invariants for the prompt
     invariant_lines = []
     if invariants.get("name"):
@@ -264,53 +521,19 @@ li{{color:#fff}}
     order_display = " > ".join(section_order) if section_order else "(not detected)"
     order_strict = [h.lower().rstrip(":") for h in section_order] if section_order else []
 
-    # CSS (define before we might use it in error path)
-    css = (
-        "<style>\n"
-        "body{font-family:system-ui,-apple-system,Segoe UI,Roboto,Helvetica,Arial,sans-serif;background:#0b1220;color:#e6eaf2;margin:24px}\n"
-        ".card{background:#121a2b;border:1px solid #223154;border-radius:14px;padding:22px;max-width:900px;margin:auto}\n"
-        "h1,h2{margin:0 0 10px} h1{font-size:28px} h2{font-size:18px;margin-top:22px}\n"
-        "ul{margin:8px 0 0 18px}\n"
-        "li{color:#fff}\n"
-        "</style>\n"
-    )
-
-    # Build the prompt
-    system = (
-        "You are a precise, ATS-friendly resume editor.\n"
-        "HARD RULES:\n"
-        "• Do NOT invent or change facts: company names, job titles, locations, date ranges, degrees, school names.\n"
-        "• Keep the original EXPERIENCE role scaffolding (employer/title/location/dates) exactly.\n"
-        "• Rewrite ONLY the bullet points to emphasize JD keywords; keep counts similar (3–6/role) and realistic.\n"
-        "• If a field is missing in the source, omit it rather than fabricating.\n"
-        "• Output a COMPLETE, valid HTML document (<!doctype html>…</html>) with modest inline CSS. No code fences.\n"
-        "• Bullets (<li>) must render with white text (set inline CSS or parent style).\n"
-        "• **Preserve the original SECTION ORDER exactly as provided.**"
-    )
-    user = (
-        "Produce a tailored resume as HTML.\n\n"
-        "HEADER INVARIANTS (must appear verbatim if present; omit blank lines):\n"
-        f"{invariant_block}\n\n"
-        "ORIGINAL SECTION ORDER (must be preserved as-is, including unfamiliar/custom sections):\n"
-        f"{order_display}\n\n"
-        "Normalized order keys (for strict compliance):\n"
-        f"{order_strict}\n\n"
-        "EXPERIENCE INVARIANTS:\n"
-        "- Read the Experience section in the RESUME TEXT and copy employer names, job titles, locations, and date ranges EXACTLY as written.\n"
-        "- Rewrite only the bullets under each role; incorporate JD keywords naturally without keyword-stuffing.\n\n"
-        "STYLE:\n"
-        "- Sections present in the source must appear in the SAME ORDER. Do not add new sections unless present in the source.\n"
-        "- Concise, metric-oriented bullets where authentic.\n"
-        "- Use <ul><li> for bullets and ensure <li> text is white via CSS.\n\n"
-        "RESUME TEXT (raw/extracted, may be partial):\n"
-        "-----\n" + (resume_text or "")[:20000] + "\n-----\n\n"
-        "JOB DESCRIPTION (sanitized):\n"
-        "-----\n" + (job_text or "")[:20000] + "\n-----\n\n"
-        f"Candidate interests/keywords: {interests or '(none)'}\n"
-    )
+    user = _USER_TMPL.format_map({
+        "invariant_block": invariant_block,
+        "order_display": order_display,
+        "order_strict": order_strict,
+        "resume": (resume_text or "")[:20000],
+        "job": (job_text or "")[:20000],
+        "interests": interests or "(none)",
+    })
 
-    # Minimal HTTP client for OpenAI
-    def _http_chat_completion(api_key: str, model: str, system_msg: str, user_msg: str, timeout_sec: float) -> str:
+    # Minimal streaming (SSE) client for OpenAI. abort_if(text_so_far) may return
+    # None (undecided), False (keep going) or True (drop this draft now).
+    def _http_chat_completion(api_key: str, model: str, system_msg: str, user_msg: str,
+                              timeout_sec: float, abort_if=None) -> str:
         payload = {
             "model": model,
             "messages": [
@@ -318,47 +541,78 @@ li{{color:#fff}}
                 {"role": "user", "content": user_msg}
             ],
             "temperature": 0.15,
+            "stream": True,
         }
-        data = _json.dumps(payload).encode("utf-8")
-        req = urllib.request.Request(
-            "https://api.openai.com/v1/chat/completions",
-            data=data,
+        data = _dumps(payload)
+        deadline = time.time() + timeout_sec
+        r = _HTTP.request(
+            "POST", "https://api.openai.com/v1/chat/completions",
+            body=data,
             headers={
                 "Authorization": f"Bearer {api_key}",
                 "Content-Type": "application/json",
                 "User-Agent": "ResumeAssistantBot/1.0"
             },
-            method="POST",
+            timeout=urllib3.Timeout(connect=4, read=timeout_sec),
+            preload_content=False,
         )
-        with urllib.request.urlopen(req, timeout=timeout_sec) as r:
-            status = getattr(r, "status", None) or r.getcode()
-            body = r.read()
-        if status != 200:
-            raise RuntimeError(f"openai_http_status={status} body={body[:200]!r}")
-        resp = _json.loads(body.decode("utf-8", "ignore"))
-        return (resp.get("choices", [{}])[0].get("message", {}).get("content", "") or "").strip()
-
-    def _order_ok(_html: str) -> bool:
-        if not section_order:
-            return True
-        pos = -1
-        text_l = _html.lower()
-        for h in section_order:
-            idx = text_l.find(_normalize_heading(h).lower().rstrip(":"))
-            if idx == -1 or idx < pos:
-                return False
-            pos = idx
-        return True
-
-    def _call_once(prompt_user: str, per_call_timeout: float):
+        finished = False
+        try:
+            if r.status != 200:
+                body = r.read()
+                raise RuntimeError(f"openai_http_status={r.status} body={body[:200]!r}")
+            parts, buf, done = [], b"", False
+            decided = abort_if is None
+            for chunk in r.stream(4096):
+                buf += chunk
+                *lines, buf = buf.split(b"\n")
+                for line in lines:
+                    line = line.strip()
+                    if done or not line.startswith(b"data:"):
+                        continue
+                    line = line[5:].strip()
+                    if line == b"[DONE]":
+                        done = True
+                        continue
+                    choice = (_loads(line).get("choices") or [{}])[0]
+                    parts.append(choice.get("delta", {}).get("content") or "")
+                if not decided:
+                    verdict = abort_if("".join(parts))
+                    if verdict is not None:
+                        decided = True
+                        if verdict:
+                            raise RuntimeError("draft rejected early (header invariants missing)")
+                if not done and time.time() > deadline:
+                    raise TimeoutError(f"openai stream exceeded {timeout_sec}s")
+            finished = True
+            return "".join(parts).strip()
+        finally:
+            if not finished:
+                r.close()  # don't hand a half-read connection back to the pool
+            r.release_conn()
+
+    name_l = (invariants.get("name") or "").lower()
+    inv_needles = [n for n in (name_l, (invariants.get("email") or "").lower()) if n]
+
+    def _header_missing_name(text: str):
+        """Once the first OPENAI_STREAM_CHECK_CHARS of <body> have streamed in,
+        report whether the candidate name is missing from them."""
+        start = text.lower().find("<body")
+        if start == -1 or len(text) - start < OPENAI_STREAM_CHECK_CHARS:
+            return None
+        return name_l not in text[start:start + OPENAI_STREAM_CHECK_CHARS].lower()
+
+    def _call_once(prompt_user: str, per_call_timeout: float, abort_if=None):
+        """Returns (html, ok); ok is False when html is the error card."""
         try:
             print("[tailor] calling OpenAI (urllib)…")
             html = _http_chat_completion(
-                api_key=api_key,
+                api_key=OPENAI_API_KEY,
                 model="gpt-4o-mini",
-                system_msg=system,
+                system_msg=_SYSTEM_PROMPT,
                 user_msg=prompt_user,
                 timeout_sec=per_call_timeout,
+                abort_if=abort_if,
             )
             print("[tailor] OpenAI response ok (urllib)")
             if not html:
@@ -366,41 +620,35 @@ li{{color:#fff}}
         except Exception as e:
             safe = htmlmod.escape(str(e))
             print(f"[tailor] OpenAI error: {e}")
-            return (
-                "<!doctype html><html><head>"+css+"</head>"
-                "<body><div class='card'>"
-                "<h2>Tailor error</h2>"
-                "<p class='muted'>OpenAI request failed or timed out.</p>"
-                "<pre>"+safe+"</pre></div></body></html>"
-            )
+            return _ERROR_TMPL.format_map({"css": _CSS, "detail": safe}), False
 
-        if "<!doctype" not in html.lower():
+        low = html.lower()  # prepending the doctype below doesn't affect the later probes
+        if "<!doctype" not in low:
             html = "<!doctype html>\n" + html
-        if "<style" not in html.lower():
+        if "<style" not in low:
             if "<head>" in html:
-                html = html.replace("<head>", "<head>\n"+css)
+                html = html.replace("<head>", "<head>\n"+_CSS)
             else:
-                body_part = html if "<html" not in html.lower() else ""
-                html = f"<!doctype html><html><head>{css}</head><body>{body_part or html}</body></html>"
+                body_part = html if "<html" not in low else ""
+                html = f"<!doctype html><html><head>{_CSS}</head><body>{body_part or html}</body></html>"
         elif "li{color" not in html:
             html = html.replace("</style>", "li{color:#fff}\n</style>")
-        return html
+        return html, True
 
-    # Attempt 1
-    html = _call_once(user, OPENAI_HTTP_TIMEOUT)
+    # Attempt 1 (may be cut short mid-stream only when a retry will follow)
+    early_abort = _header_missing_name if (OPENAI_MAX_RETRIES > 0 and name_l) else None
+    html, ok = _call_once(user, OPENAI_HTTP_TIMEOUT, early_abort)
+    order_ok, inv_ok = _check_draft(html.lower(), order_strict, inv_needles)
 
     # Retry once if it missed invariants/order (and caller allows)
-    if (OPENAI_MAX_RETRIES > 0) and (not _ensure_invariants_present(html, invariants) or not _order_ok(html)):
-        print("[tailor] retrying due to invariant/order check or previous error")
-        time.sleep(0.3)
-        retry_user = user + (
-            "\n\nIMPORTANT: Your previous draft missed invariants and/or original section order. Regenerate and:\n"
-            "- Include header invariants verbatim if present.\n"
-            "- Keep EXACT section order as listed; do not rename or reorder sections.\n"
-            "- Keep employer/title/location/date scaffolding exactly; only rewrite bullets."
-        )
-        html2 = _call_once(retry_user, OPENAI_HTTP_TIMEOUT)
-        if _ensure_invariants_present(html2, invariants) and _order_ok(html2):
+    if (OPENAI_MAX_RETRIES > 0) and not (ok and order_ok and inv_ok):
+        print("[tailor] retrying due to invariant/order check or previous error",
+              {"ok": ok, "order_ok": order_ok, "inv_ok": inv_ok})
+        retry_user = user + _RETRY_SUFFIX
+        html2, ok2 = _call_once(retry_user, OPENAI_HTTP_TIMEOUT)
+        order_ok2, inv_ok2 = _check_draft(html2.lower(), order_strict, inv_needles)
+        # An imperfect second draft still beats the first attempt's error card.
+        if ok2 and (not ok or (order_ok2 and inv_ok2)):
             html = html2
 
     return html
@@ -420,13 +668,14 @@ def handle_diag():
         out["steps"].append({"tcp_tls": f"error: {e}"})
     # Step B: HTTPS GET /v1/models with your key
     try:
-        req = urllib.request.Request(
-            "https://api.openai.com/v1/models",
-            headers={"Authorization": f"Bearer {os.environ.get('OPENAI_API_KEY','')}"}
+        r = _HTTP.request(
+            "GET", "https://api.openai.com/v1/models",
+            headers=_DIAG_AUTH_HEADER,
+            timeout=6,
         )
-        with urllib.request.urlopen(req, timeout=6) as r:
-            status = getattr(r, "status", None) or r.getcode()
-            out["steps"].append({"models_http_status": status})
+        if r.status >= 400:
+            raise RuntimeError(f"HTTP Error {r.status}")
+        out["steps"].append({"models_http_status": r.status})
     except Exception as e:
         out["ok"] = False
         out["steps"].append({"models_error": str(e)})
@@ -442,7 +691,10 @@ def handle_get_document_html(event):
     if not (user_id and doc_id):
         return _resp(400, {"error": "Missing userId or documentId"})
 
-    item = _find_doc_by_id(user_id, doc_id)
+    try:
+        item = _find_doc_by_id(user_id, doc_id)
+    except botocore.exceptions.ClientError as e:
+        return _resp(500, {"error": "DynamoDB read failed", "detail": str(e)})
     if not item:
         return _resp(404, {"error": "Document not found"})
 
@@ -454,7 +706,7 @@ def handle_get_document_html(event):
         return _resp(500, {"error": "Document missing s3Key"})
 
     try:
-        obj = s3.get_object(Bucket=BUCKET, Key=key)
+        obj = _s3().get_object(Bucket=BUCKET, Key=key)
         body_bytes = obj["Body"].read()
     except Exception as e:
         return _resp(500, {"error": "Failed to read S3 object", "detail": str(e)})
@@ -517,6 +769,31 @@ def lambda_handler(event, context):
     return _resp(404, {"error": "Not found", "path": path, "method": method})
 
 # ------------------ Routes ------------------
+def _store_doc(s3_put: dict, item: dict, undo_s3: bool = True) -> None:
+    """Write the S3 object and its DOCS_TABLE item concurrently. If either
+    write fails, undo the one that succeeded and re-raise the error.
+    undo_s3=False leaves the object in place; use it when the key may be
+    shared with an existing document (re-uploads overwrite the same key)."""
+    s3c, table = _s3(), _docs_table()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+        s3_fut = pool.submit(s3c.put_object, **s3_put)
+        ddb_err = None
+        try:
+            table.put_item(Item=item)
+        except Exception as e:
+            ddb_err = e
+        s3_err = s3_fut.exception()
+    if s3_err is None and ddb_err is None:
+        return
+    try:
+        if s3_err is None and undo_s3:
+            s3c.delete_object(Bucket=s3_put["Bucket"], Key=s3_put["Key"])
+        if ddb_err is None:
+            table.delete_item(Key={"userId": item["userId"], "documentId": item["documentId"]})
+    except Exception as e:
+        print("[docs] compensation failed", str(e))
+    raise s3_err or ddb_err
+
 def handle_upload_resume(body):
     user_id = (body.get("userId") or "demo").strip()
     filename = (body.get("filename") or f"resume-{uuid.uuid4()}.txt").strip()
@@ -528,12 +805,6 @@ def handle_upload_resume(body):
     if ext not in ALLOWED_EXTS:
         return _resp(415, {"error": "Unsupported file type. Allowed: PDF, DOC, DOCX, TXT"})
 
-    try:
-        if _count_docs_for_user(user_id) >= MAX_DOCS_PER_USER:
-            return _resp(429, {"error": f"Doc limit reached ({MAX_DOCS_PER_USER})."})
-    except Exception:
-        pass
-
     try:
         data = base64.b64decode(content_b64)
     except Exception:
@@ -542,28 +813,42 @@ def handle_upload_resume(body):
     if len(data) > 10 * 1024 * 1024:
         return _resp(413, {"error": "File too large (>10MB)"})
 
+    reserved = False
+    try:
+        if not _reserve_doc_slot(user_id):
+            return _resp(429, {"error": f"Doc limit reached ({MAX_DOCS_PER_USER})."})
+        reserved = True
+    except Exception:
+        pass
+
     content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
     key = f"resumes/{user_id}/{filename}"
 
-    try:
-        s3.put_object(Bucket=BUCKET, Key=key, Body=data,
-                      ContentType=content_type, ContentDisposition="inline")
-    except botocore.exceptions.ClientError as e:
-        return _resp(500, {"error": "Upload failed", "detail": str(e)})
-
     doc_id = str(uuid.uuid4())
     now = _now()
-    DOCS_TABLE.put_item(Item={
-        "userId": user_id,
-        "documentId": doc_id,
-        "type": "resume_original",
-        "s3Key": key,
-        "contentType": content_type,
-        "size": len(data),
-        "createdAt": now
-    })
+    try:
+        _store_doc(
+            dict(Bucket=BUCKET, Key=key, Body=data,
+                 ContentType=content_type, ContentDisposition="inline"),
+            {
+                "userId": user_id,
+                "documentId": doc_id,
+                "type": "resume_original",
+                "s3Key": key,
+                "contentType": content_type,
+                "size": len(data),
+                "createdAt": now
+            },
+            undo_s3=False,  # key is per-filename; an older doc may point at it
+        )
+    except Exception as e:
+        if reserved:
+            _release_doc_slot(user_id)
+        return _resp(500, {"error": "Store failed", "detail": str(e)})
+    if not reserved:
+        _bump_doc_counter_quietly(user_id)
 
-    url = s3.generate_presigned_url(
+    url = _s3().generate_presigned_url(
         "get_object", Params={"Bucket": BUCKET, "Key": key}, ExpiresIn=300
     )
 
@@ -580,35 +865,59 @@ def handle_create_application(body):
         "status": body.get("status", "CREATED"),
         "createdAt": _now()
     }
-    APPL_TABLE.put_item(Item=item)
+    _appl_table().put_item(Item=item)
     return _resp(200, item)
 
+@functools.lru_cache(maxsize=1)
+def _presign_base() -> str:
+    """URL prefix (scheme, host and, for path-style, the bucket) that the S3
+    client itself picks for BUCKET. Taken from one real presign so endpoint
+    resolution and addressing style (virtual-host vs path for dotted bucket
+    names) match generate_presigned_url exactly."""
+    probe = _s3().generate_presigned_url(
+        "get_object", Params={"Bucket": BUCKET, "Key": "_"}, ExpiresIn=1
+    )
+    parts = urllib.parse.urlsplit(probe)
+    return f"{parts.scheme}://{parts.netloc}{parts.path[:-1]}"
+
+def _get_url_signer(expires: int):
+    """Return key -> presigned GET URL, sharing one SigV4 query signer so a
+    listing doesn't pay the full generate_presigned_url pipeline per item.
+    Output matches generate_presigned_url for the same key and timestamp."""
+    s3c = _s3()  # also ensures boto3's default session (and its credentials) exist
+    base = _presign_base()
+    creds = boto3.DEFAULT_SESSION.get_credentials().get_frozen_credentials()
+    signer = S3SigV4QueryAuth(creds, "s3", s3c.meta.region_name, expires=expires)
+
+    def sign(key: str) -> str:
+        req = AWSRequest(method="GET", url=base + urllib.parse.quote(key, safe="/~"))
+        signer.add_auth(req)
+        return req.url
+    return sign
+
 def handle_list_documents(event):
     qs = event.get("queryStringParameters") or {}
     user_id = (qs.get("userId") or "demo").strip()
     items = []
     try:
-        resp = DOCS_TABLE.query(
+        resp = _docs_table().query(
             KeyConditionExpression=Key("userId").eq(user_id),
             Limit=100, ScanIndexForward=False
         )
         items = resp.get("Items", [])
     except botocore.exceptions.ClientError as e:
-        err = e.response.get("Error", {}).get("Code")
-        msg = e.response.get("Error", {}).get("Message", "")
-        if err == "ValidationException" or "Query condition missed key schema" in msg:
-            resp = DOCS_TABLE.scan(Limit=100, FilterExpression=Attr("userId").eq(user_id))
-            items = resp.get("Items", [])
-        else:
-            return _resp(500, {"error": "DynamoDB query failed", "detail": str(e)})
+        return _resp(500, {"error": "DynamoDB query failed", "detail": str(e)})
+    items = [it for it in items if it.get("documentId") != COUNTER_DOC_ID]
 
-    for it in items:
-        try:
-            it["url"] = s3.generate_presigned_url(
-                "get_object", Params={"Bucket": BUCKET, "Key": it["s3Key"]}, ExpiresIn=300
-            )
-        except Exception:
-            pass
+    try:
+        sign = _get_url_signer(300)
+    except Exception as e:
+        print("[documents] presign unavailable", str(e))
+        sign = None
+    if sign:
+        for it in items:
+            if it.get("s3Key"):
+                it["url"] = sign(it["s3Key"])
 
     return _resp(200, {"items": items, "count": len(items)})
 
@@ -619,7 +928,7 @@ def handle_delete_document(event):
             b = event["body"]
             if event.get("isBase64Encoded"):
                 b = base64.b64decode(b).decode()
-            body = json.loads(b or "{}")
+            body = _loads(b or "{}")
         except Exception:
             body = {}
     qs = event.get("queryStringParameters") or {}
@@ -629,19 +938,13 @@ def handle_delete_document(event):
 
     if not (user_id and (document_id or explicit_key)):
         return _resp(400, {"error": "Fields required: userId AND (documentId OR s3Key)"})
+    if document_id == COUNTER_DOC_ID:
+        return _resp(400, {"error": "Invalid documentId"})
 
     item = None
     if not explicit_key:
         try:
-            res = DOCS_TABLE.get_item(Key={"userId": user_id, "documentId": document_id})
-            item = res.get("Item")
-            if not item:
-                scan = DOCS_TABLE.scan(
-                    Limit=1,
-                    FilterExpression=(Attr("userId").eq(user_id) & Attr("documentId").eq(document_id))
-                )
-                if scan.get("Items"):
-                    item = scan["Items"][0]
+            item = _find_doc_by_id(user_id, document_id)
         except botocore.exceptions.ClientError as e:
             return _resp(500, {"error": "DynamoDB read failed", "detail": str(e)})
 
@@ -652,7 +955,7 @@ def handle_delete_document(event):
     s3_deleted = False
     if explicit_key:
         try:
-            s3.delete_object(Bucket=BUCKET, Key=explicit_key)
+            _s3().delete_object(Bucket=BUCKET, Key=explicit_key)
             s3_deleted = True
         except botocore.exceptions.ClientError as e:
             err = e.response.get("Error", {}).get("Code", "")
@@ -661,12 +964,16 @@ def handle_delete_document(event):
 
     ddb_deleted = False
     try:
+        del_key = None
         if item:
-            DOCS_TABLE.delete_item(Key={"userId": item["userId"], "documentId": item["documentId"]})
-            ddb_deleted = True
+            del_key = {"userId": item["userId"], "documentId": item["documentId"]}
         elif document_id:
-            DOCS_TABLE.delete_item(Key={"userId": user_id, "documentId": document_id})
+            del_key = {"userId": user_id, "documentId": document_id}
+        if del_key:
+            res = _docs_table().delete_item(Key=del_key, ReturnValues="ALL_OLD")
             ddb_deleted = True
+            if res.get("Attributes"):
+                _release_doc_slot(del_key["userId"])
     except botocore.exceptions.ClientError as e:
         return _resp(500, {"error": "DynamoDB delete failed", "detail": str(e)})
 
@@ -676,6 +983,17 @@ def handle_delete_document(event):
         "documentId": document_id or (item.get("documentId") if item else None)
     })
 
+def _read_resume_text(src_key: str, src_ct: str) -> str:
+    """Fetch the source resume from S3 and return its text (PDF/text only)."""
+    obj = _s3().get_object(Bucket=BUCKET, Key=src_key)
+    data = obj["Body"].read()
+    print("[tailor] fetched resume bytes", {"ct": src_ct, "len": len(data)})
+    if src_ct == "application/pdf" or data.startswith(b"%PDF"):
+        return _extract_pdf_text(data)
+    if src_ct.startswith("text/") or src_ct in ("application/json", "application/xml"):
+        return data.decode("utf-8", errors="replace")[:20000]
+    return f"[Original content-type {src_ct} not parsed]"
+
 def handle_tailor(event):
     """
     Body: { userId, documentId, jobUrl, interests }
@@ -693,12 +1011,9 @@ def handle_tailor(event):
         return _resp(400, {"error": "Fields required: userId, documentId, jobUrl"})
 
     try:
-        if _count_docs_for_user(user_id) >= MAX_DOCS_PER_USER:
-            return _resp(429, {"error": f"Document limit reached ({MAX_DOCS_PER_USER})"})
-    except Exception:
-        pass
-
-    item = _find_doc_by_id(user_id, source_doc_id)
+        item = _find_doc_by_id(user_id, source_doc_id)
+    except botocore.exceptions.ClientError as e:
+        return _resp(500, {"error": "DynamoDB read failed", "detail": str(e)})
     if not item:
         return _resp(404, {"error": "Source document not found", "documentId": source_doc_id})
 
@@ -707,66 +1022,81 @@ def handle_tailor(event):
     if not src_key:
         return _resp(400, {"error": "Source item missing s3Key"})
 
-    resume_text = ""
+    # One conditional write up front; released below unless the doc gets stored.
+    reserved = False
     try:
-        obj = s3.get_object(Bucket=BUCKET, Key=src_key)
-        data = obj["Body"].read()
-        print("[tailor] fetched resume bytes", {"ct": src_ct, "len": len(data)})
-        if src_ct == "application/pdf" or data.startswith(b"%PDF"):
-            resume_text = _extract_pdf_text(data)
-        elif src_ct.startswith("text/") or src_ct in ("application/json", "application/xml"):
-            resume_text = data.decode("utf-8", errors="replace")[:20000]
-        else:
-            resume_text = f"[Original content-type {src_ct} not parsed]"
-    except Exception as e:
-        print("[tailor] error reading resume", str(e))
-        resume_text = "[Could not fetch original resume bytes]"
-
-    job_text = _get_text_from_url(job_url)
-    print("[tailor] fetched job text len", len(job_text))
+        if not _reserve_doc_slot(user_id):
+            return _resp(429, {"error": f"Document limit reached ({MAX_DOCS_PER_USER})"})
+        reserved = True
+    except Exception:
+        pass
 
-    print("[tailor] calling _ai_tailor_resume_html")
-    html = _ai_tailor_resume_html(resume_text, job_text, interests)
-    print("[tailor] got html len", len(html))
-    html_bytes = html.encode("utf-8")
+    stored = False
+    try:
+        # Resume fetch and JD fetch are independent network I/O; overlap them.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+            resume_fut = pool.submit(_read_resume_text, src_key, src_ct)
+            job_fut = pool.submit(_get_text_from_url, job_url)
+            try:
+                resume_text = resume_fut.result()
+            except Exception as e:
+                print("[tailor] error reading resume", str(e))
+                resume_text = "[Could not fetch original resume bytes]"
+            try:
+                job_text = job_fut.result()
+            except Exception as e:
+                job_text = f"[Could not fetch JD: {e}]"
+        print("[tailor] fetched job text len", len(job_text))
 
-    base = _basename(src_key).rsplit(".", 1)[0]
-    now = int(time.time())
-    html_key = f"resumes/{user_id}/tailored/{base}__tailored_{now}.html"
+        print("[tailor] calling _ai_tailor_resume_html")
+        html = _ai_tailor_resume_html(resume_text, job_text, interests)
+        print("[tailor] got html len", len(html))
+        html_bytes = html.encode("utf-8")
 
-    try:
-        s3.put_object(
-            Bucket=BUCKET, Key=html_key, Body=html_bytes,
-            ContentType="text/html; charset=utf-8",
-            ContentDisposition="inline", CacheControl="no-cache",
-            ServerSideEncryption="AES256",
-            Metadata={
-                "type": "resume_tailored",
-                "sourcedocumentid": source_doc_id,
-                "joburl": job_url,
-                "interests": interests or "",
-            },
-        )
-        print("[tailor] wrote html to s3", {"key": html_key, "size": len(html_bytes)})
-    except botocore.exceptions.ClientError as e:
-        return _resp(500, {"error": "S3 put failed", "detail": str(e)})
+        base = _basename(src_key).rsplit(".", 1)[0]
+        now = int(time.time())
+        html_key = f"resumes/{user_id}/tailored/{base}__tailored_{now}.html"
 
-    new_doc_id = str(uuid.uuid4())
-    DOCS_TABLE.put_item(Item={
-        "userId": user_id,
-        "documentId": new_doc_id,
-        "type": "resume_tailored",
-        "s3Key": html_key,
-        "contentType": "text/html",
-        "size": len(html_bytes),
-        "sourceDocumentId": source_doc_id,
-        "jobUrl": job_url,
-        "interests": interests or "",
-        "createdAt": now,
-    })
+        new_doc_id = str(uuid.uuid4())
+        try:
+            _store_doc(
+                dict(
+                    Bucket=BUCKET, Key=html_key, Body=html_bytes,
+                    ContentType="text/html; charset=utf-8",
+                    ContentDisposition="inline", CacheControl="no-cache",
+                    ServerSideEncryption="AES256",
+                    Metadata={
+                        "type": "resume_tailored",
+                        "sourcedocumentid": source_doc_id,
+                        "joburl": job_url,
+                        "interests": interests or "",
+                    },
+                ),
+                {
+                    "userId": user_id,
+                    "documentId": new_doc_id,
+                    "type": "resume_tailored",
+                    "s3Key": html_key,
+                    "contentType": "text/html",
+                    "size": len(html_bytes),
+                    "sourceDocumentId": source_doc_id,
+                    "jobUrl": job_url,
+                    "interests": interests or "",
+                    "createdAt": now,
+                },
+            )
+            print("[tailor] wrote html to s3", {"key": html_key, "size": len(html_bytes)})
+        except Exception as e:
+            return _resp(500, {"error": "Store failed", "detail": str(e)})
+        stored = True
+        if not reserved:
+            _bump_doc_counter_quietly(user_id)
+    finally:
+        if reserved and not stored:
+            _release_doc_slot(user_id)
     print("[tailor] indexed in ddb", {"docId": new_doc_id})
 
-    url = s3.generate_presigned_url(
+    url = _s3().generate_presigned_url(
         "get_object", Params={"Bucket": BUCKET, "Key": html_key}, ExpiresIn=300,
     )
     print("[tailor] done")